@@ -102,11 +102,15 @@ _deps_internal_set_cache_from_env_or_default(DEPS_HEADER_SUBDIR "header-only" ST
 _deps_internal_set_cache_from_env_or_default(DEPS_CACHE_DIR "" PATH "Directory with git hash (left empty to use library directory)")
 _deps_internal_set_cache_from_env_or_default(DEPS_PYTHON_PATH "" FILEPATH "Python interpreter executable")
 _deps_internal_set_cache_from_env_or_default(DEPS_SCRIPT_PATH "${PROJECT_SOURCE_DIR}/${DEPS_THIRD_PARTY_SUBDIR}/deps.py" FILEPATH "Python helper script path")
+_deps_internal_set_cache_from_env_or_default(DEPS_COMPILER_CACHE "auto" STRING "Compiler cache for CMake-based libraries: auto, off, ccache or sccache")
+_deps_internal_set_cache_from_env_or_default(DEPS_JOBS "1" STRING "Number of libraries installed in parallel (only for independent libraries)")
 
 mark_as_advanced(DEPS_HEADER_SUBDIR)
 mark_as_advanced(DEPS_CACHE_DIR)
 mark_as_advanced(DEPS_PYTHON_PATH)
 mark_as_advanced(DEPS_SCRIPT_PATH)
+mark_as_advanced(DEPS_COMPILER_CACHE)
+mark_as_advanced(DEPS_JOBS)
 
 set(DEPS_HEADER_ONLY_INCLUDE_DIR "${DEPS_INSTALL_DIR}/${DEPS_HEADER_SUBDIR}")
 set(_deps_internal_cmd_args "")
@@ -410,6 +414,15 @@ function(deps_build_all)
         list(APPEND DEPS_INSTALL_CMD "--header-subdir=${DEPS_HEADER_SUBDIR}")
     endif()
 
+    # "off" is a CMake false constant, so test for an empty value instead
+    if(NOT DEPS_COMPILER_CACHE STREQUAL "")
+        list(APPEND DEPS_INSTALL_CMD "--compiler-cache=${DEPS_COMPILER_CACHE}")
+    endif()
+
+    if(DEPS_JOBS)
+        list(APPEND DEPS_INSTALL_CMD "--jobs=${DEPS_JOBS}")
+    endif()
+
     list(APPEND DEPS_INSTALL_CMD "${_deps_internal_cmd_args}")
 
     cmake_path(GET DEPS_SCRIPT_PATH PARENT_PATH _script_dir)
@@ -36,17 +36,23 @@
 
 
 import argparse
-import itertools
+import fnmatch
+import functools
+import hashlib
+import json
 import os
 import platform
+import re
 import shlex
 import shutil
+import stat
 import subprocess
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from enum import IntEnum
-from glob import glob
 from pathlib import Path
-from typing import Generic, Optional, TypeVar
+from typing import Any, Generic, Optional, TypeVar
 
 SOURCES_ROOT: Path
 INSTALL_ROOT: Path
@@ -54,6 +60,31 @@ CACHE_ROOT: Optional[Path]
 HEADER_SUBDIR: Path
 CMAKE: str
 CMAKE_GLOBAL_ARGS: list[str]
+CLEAN_INSTALL: bool
+COMPILER_CACHE: Optional[str]
+FORCE_CLEAN: bool
+JOBS: int = 1
+USE_NINJA: bool = False
+HARDLINK: bool = os.name != "nt"
+PRESEED: bool = True
+
+# Initial cache with results of configure checks that never change for MSVC
+MSVC_PRESEED_FILE = Path(__file__).parent / "presets" / "msvc_preseed.cmake"
+
+# Name of the host system, e.g. 'Windows' or 'Linux'
+PLATFORM = platform.system()
+
+# Number of bytes locked in lock files on Windows (whole file)
+LOCK_RANGE = 0x7FFFFFFF
+
+# Install trees of CMake libraries kept per library in '<CACHE_DIR>/installs'
+INSTALL_SNAPSHOTS_KEPT = 3
+
+# Second line of a stored manifest, followed by fingerprint of the build folder it was installed from
+BUILD_STATE_PREFIX = "# build "
+
+# SHA-1 or SHA-256 object name
+GIT_HASH_REGEX = re.compile(r"[0-9a-f]{40}|[0-9a-f]{64}")
 
 
 class LogType(IntEnum):
@@ -77,22 +108,264 @@ class TerminalColors:
     FAIL = "\033[91m"
     ENDC = "\033[0m"
 
-# TODO: more logging
+
+# Colors are left out when output isn't a terminal (e.g. CI logs) or NO_COLOR is set,
+# CLICOLOR_FORCE keeps them anyway
+USE_COLOR = os.environ.get("CLICOLOR_FORCE", "0") != "0" or (
+    sys.stdout is not None and sys.stdout.isatty() and not os.environ.get("NO_COLOR")
+)
+
+if USE_COLOR:
+    LOG_PREFIX = {
+        LogType.Info: TerminalColors.OKBLUE,
+        LogType.Success: TerminalColors.OKGREEN,
+        LogType.Warning: TerminalColors.WARNING,
+        LogType.Error: TerminalColors.FAIL,
+    }
+    LOG_SUFFIX = TerminalColors.ENDC
+else:
+    LOG_PREFIX = {
+        LogType.Info: "",
+        LogType.Success: "",
+        LogType.Warning: "",
+        LogType.Error: "",
+    }
+    LOG_SUFFIX = ""
+
+# Set by --verbose
 CURRENT_LOG_LEVEL: LogLevel = LogLevel.Normal
 
+# Libraries may be installed from several threads, keep their messages whole
+LOG_LOCK = threading.Lock()
+
 
 def log(message, log_type: LogType = LogType.Info, log_level: LogLevel = LogLevel.Normal):
     if log_level > CURRENT_LOG_LEVEL:
         return
 
-    if log_type == LogType.Error:
-        print(f"{TerminalColors.FAIL}{message}{TerminalColors.ENDC}", flush=True)
-    elif log_type == LogType.Warning:
-        print(f"{TerminalColors.WARNING}{message}{TerminalColors.ENDC}", flush=True)
-    elif log_type == LogType.Success:
-        print(f"{TerminalColors.OKGREEN}{message}{TerminalColors.ENDC}", flush=True)
+    with LOG_LOCK:
+        print(LOG_PREFIX[log_type], message, LOG_SUFFIX, sep="", flush=True)
+
+
+# Writes raw output of a child process
+def log_output(output: bytes) -> None:
+    with LOG_LOCK:
+        sys.stdout.flush()
+        sys.stdout.buffer.write(output)
+        sys.stdout.buffer.flush()
+
+
+# Runs a command with stdout and stderr captured and forwards its output as it
+# arrives. With several jobs it is forwarded by whole lines prefixed with the
+# library name, so output of libraries built in parallel stays readable.
+def run_command(cmd: list[str], cwd: Path, lib_name: str) -> None:
+    with subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT) as proc:
+        assert proc.stdout is not None
+
+        if JOBS == 1:
+            while chunk := proc.stdout.read1(65536):
+                log_output(chunk)
+        else:
+            prefix = f"[{lib_name}] ".encode()
+            for line in proc.stdout:
+                log_output(prefix + line if line.endswith(b"\n") else prefix + line + b"\n")
+
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+
+# _IOW(0x94, 9, int) from linux/fs.h
+FICLONE = 0x40049409
+
+
+# clonefile(2) from libSystem, None if it isn't available
+@functools.cache
+def load_clonefile() -> Any:
+    import ctypes
+
+    try:
+        clonefile = ctypes.CDLL(None, use_errno=True).clonefile
+    except (OSError, AttributeError):
+        return None
+    clonefile.argtypes = [ ctypes.c_char_p, ctypes.c_char_p, ctypes.c_uint32 ]
+    clonefile.restype = ctypes.c_int
+    return clonefile
+
+
+# Copies file content, permissions and modification time. Unlike shutil.copy2 it
+# stats the source only once and shares data blocks where file system allows it:
+# FICLONE or copy_file_range on Linux (btrfs, XFS, ...), clonefile on macOS (APFS)
+# and CopyFileExW on Windows (block cloning on ReFS). Otherwise data is copied
+# in kernel by shutil.copyfile.
+def fast_copy(src: str, dst: str) -> None:
+    if os.name == "nt":
+        import ctypes
+        from ctypes import wintypes
+
+        copy_file = ctypes.windll.kernel32.CopyFileExW
+        copy_file.argtypes = [
+            wintypes.LPCWSTR, wintypes.LPCWSTR, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, wintypes.DWORD
+        ]
+        copy_file.restype = wintypes.BOOL
+
+        # Also copies attributes and timestamps
+        if not copy_file(src, dst, None, None, None, 0):
+            raise ctypes.WinError()
+        return
+
+    st = os.stat(src)
+    mode = stat.S_IMODE(st.st_mode)
+
+    if sys.platform.startswith("linux"):
+        import fcntl
+
+        copied = False
+        src_fd = os.open(src, os.O_RDONLY)
+        try:
+            dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+            try:
+                fcntl.ioctl(dst_fd, FICLONE, src_fd)
+                copied = True
+            except OSError:
+                # Not a reflink capable file system, or different ones.
+                # copy_file_range still avoids copying through user space.
+                try:
+                    offset = 0
+                    while offset < st.st_size:
+                        n = os.copy_file_range(src_fd, dst_fd, st.st_size - offset, offset, offset)
+                        if n == 0:
+                            break
+                        offset += n
+                    copied = offset == st.st_size
+                except OSError:
+                    pass
+            finally:
+                os.close(dst_fd)
+        finally:
+            os.close(src_fd)
+
+        if not copied:
+            shutil.copyfile(src, dst)
+    elif sys.platform == "darwin" and (clonefile := load_clonefile()) is not None:
+        # clonefile doesn't overwrite existing files
+        if os.path.lexists(dst):
+            os.unlink(dst)
+        if clonefile(os.fsencode(src), os.fsencode(dst), 0) != 0:
+            shutil.copyfile(src, dst)
     else:
-        print(f"{TerminalColors.OKBLUE}{message}{TerminalColors.ENDC}", flush=True)
+        shutil.copyfile(src, dst)
+
+    os.chmod(dst, mode)
+    os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+# Installs a file of a manual library. A hard link to the source is made when
+# allowed, which takes no time regardless of file size, otherwise (different file
+# systems, no link support) the file is copied. Existing target is removed first:
+# it may be a link to the source made by an earlier run, and copying over it
+# would truncate the source.
+def link_or_copy(src: str, dst: str) -> None:
+    try:
+        os.unlink(dst)
+    except FileNotFoundError:
+        pass
+
+    if HARDLINK:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    fast_copy(src, dst)
+
+
+# Writes to a temporary file first, so a crash or a concurrent reader never sees
+# a half-written file. Temporary name is unique per process and thread, so
+# concurrent writers don't replace each other's temporary files.
+def write_atomic(path: Path, data: bytes) -> None:
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+    try:
+        tmp_path.write_bytes(data)
+    except FileNotFoundError:
+        # Folder is created only on first write
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path.write_bytes(data)
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+# Exclusive lock of a file, held while a build folder is used by this script.
+# Record locks (lockf) are used instead of flock, as they also work on network
+# file systems. They are held per process though, so locks held by other
+# threads of this process are tracked separately.
+class FileLock(object):
+    path: Path
+    file: Optional[Any]
+
+    held: set[str] = set()
+    held_lock = threading.Lock()
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.file = None
+
+    def _Key(self) -> str:
+        return os.path.normcase(os.path.abspath(self.path))
+
+    # Returns False if the file is already locked, doesn't wait
+    def Acquire(self) -> bool:
+        with FileLock.held_lock:
+            if self._Key() in FileLock.held:
+                return False
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                # Append mode doesn't truncate the file, which fails on Windows while
+                # another process holds the lock
+                f = open(self.path, "a")
+            except OSError:
+                return False
+
+            try:
+                if os.name == "nt":
+                    import msvcrt
+
+                    # Lock the whole possible range, not just the first byte
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, LOCK_RANGE)
+                else:
+                    import fcntl
+
+                    fcntl.lockf(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                return False
+
+            self.file = f
+            FileLock.held.add(self._Key())
+            return True
+
+    def Release(self) -> None:
+        if self.file is None:
+            return
+
+        with FileLock.held_lock:
+            try:
+                # Windows doesn't guarantee when locks of a closed file are released
+                if os.name == "nt":
+                    import msvcrt
+
+                    self.file.seek(0)
+                    msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, LOCK_RANGE)
+            except OSError:
+                pass
+            finally:
+                self.file.close()
+                self.file = None
+                FileLock.held.discard(self._Key())
 
 
 class InstallingLibrary(object):
@@ -101,49 +374,99 @@ class InstallingLibrary(object):
     install_dir: Path
     source_dir_base: Path
     install_dir_base: Path
+    hash_file: Optional[Path]
     git_hash: Optional[str]
-
-    def __init__(self, source_dir_base: Path, install_dir_base: Path) -> None:
-        self.lib_name = source_dir_base.name
-        self.source_dir = SOURCES_ROOT / source_dir_base
-        self.install_dir = INSTALL_ROOT / install_dir_base
-        self.source_dir_base = source_dir_base
-        self.install_dir_base = install_dir_base
+    content_hash: Optional[str]
+    witnesses: Optional[dict[str, Any]]
+    previous_hashes: dict[str, Any]
+
+    # Paths come from the command line as strings, Path objects are made only here
+    def __init__(self, source_dir_base: str, install_dir_base: str) -> None:
+        self.source_dir_base = Path(source_dir_base)
+        self.install_dir_base = Path(install_dir_base)
+        self.lib_name = self.source_dir_base.name
+        self.source_dir = SOURCES_ROOT / self.source_dir_base
+        self.install_dir = INSTALL_ROOT / self.install_dir_base
+        self.hash_file = None
         self.git_hash = None
+        self.content_hash = None
+        self.witnesses = None
+        self.previous_hashes = {}
 
+    # Hash file is a small JSON object, e.g. {"git": "...", "build": "...", "stat": {...}}
     @staticmethod
-    def WriteLineAt(path: Path, n: int, text: str) -> None:
-        path.parent.mkdir(parents=True, exist_ok=True)
+    def LoadHashes(path: Path) -> dict[str, Any]:
+        try:
+            hashes = json.loads(path.read_bytes())
+        except (OSError, ValueError):
+            return {}
+        return hashes if isinstance(hashes, dict) else {}
 
-        if path.exists():
-            with path.open("r", encoding="utf-8") as f:
-                lines = f.readlines()
-        else:
-            lines = []
+    @staticmethod
+    def StoreHashes(path: Path, hashes: dict[str, Any]) -> None:
+        write_atomic(path, json.dumps(hashes).encode())
 
-        while len(lines) < n:
-            lines.append("\n")
+    def BuildAndInstall(self) -> None:
+        raise NotImplementedError
 
-        lines[n - 1] = text.rstrip("\n") + "\n"
-        with path.open("w", encoding="utf-8") as f:
-            f.writelines(lines)
+    # Returns git folder (HEAD, index) and common folder (refs, packed-refs) of a
+    # work tree. In submodules and worktrees '.git' is a file pointing to the git
+    # folder, and worktrees share refs of the main repository through 'commondir'.
+    @staticmethod
+    def GetGitDirs(work_tree: Path) -> Optional[tuple[str, str]]:
+        dot_git = os.path.join(work_tree, ".git")
+        if os.path.isdir(dot_git):
+            git_dir = dot_git
+        else:
+            try:
+                content = Path(dot_git).read_text(encoding="utf-8").strip()
+            except OSError:
+                return None
+            if not content.startswith("gitdir: "):
+                return None
+            git_dir = os.path.join(work_tree, content[len("gitdir: "):])
 
+        try:
+            common_dir = os.path.join(git_dir, Path(git_dir, "commondir").read_text(encoding="utf-8").strip())
+        except OSError:
+            common_dir = git_dir
+        return os.path.normpath(git_dir), os.path.normpath(common_dir)
+
+    # Reads HEAD commit straight from the git folder, so no git process is spawned.
+    # Returns None for layouts it doesn't understand, in which case git itself
+    # should be asked.
     @staticmethod
-    def ReadLineAt(path: Path, n: int) -> Optional[str]:
-        if not path.exists():
+    def _ReadGitHead(work_tree: Path) -> Optional[str]:
+        git_dirs = InstallingLibrary.GetGitDirs(work_tree)
+        if git_dirs is None:
             return None
+        git_dir, common_dir = git_dirs
 
-        with path.open("r", encoding="utf-8") as f:
-            for i, line in enumerate(f, start=1):
-                if i == n:
-                    return line.rstrip("\n")
-
+        try:
+            head = Path(git_dir, "HEAD").read_text(encoding="utf-8").strip()
+            if not head.startswith("ref: "):
+                return head if GIT_HASH_REGEX.fullmatch(head) else None
+
+            ref = head[len("ref: "):]
+            ref_file = Path(common_dir, ref)
+            if ref_file.is_file():
+                commit = ref_file.read_text(encoding="utf-8").strip()
+                return commit if GIT_HASH_REGEX.fullmatch(commit) else None
+
+            # Ref was packed by 'git gc' or 'git clone'
+            for line in Path(common_dir, "packed-refs").read_text(encoding="utf-8").splitlines():
+                if line.startswith(("#", "^")):
+                    continue
+                commit, _, name = line.partition(" ")
+                if name == ref and GIT_HASH_REGEX.fullmatch(commit):
+                    return commit
+        except OSError:
+            pass
         return None
 
-    def BuildAndInstall(self) -> None:
-        raise NotImplementedError
-
     def GetGitHash(self) -> str:
+        if self.git_hash is None:
+            self.git_hash = self._ReadGitHead(self.source_dir)
         if self.git_hash is None:
             self.git_hash = subprocess.run(
                 ["git", "-C", str(self.source_dir), "rev-parse", "HEAD"],
@@ -151,34 +474,176 @@ class InstallingLibrary(object):
             ).stdout.strip()
         return self.git_hash
 
-    def CheckGitHash(self, hash_file: Path) -> bool:
+    # Hash of all tracked source files, including uncommitted changes. Blob hashes
+    # are taken from the git index, only files modified since then are read and
+    # hashed the same way git does it. Falls back to HEAD commit if git can't list
+    # the files.
+    def GetContentHash(self) -> str:
+        if self.content_hash is not None:
+            return self.content_hash
+
         try:
-            return self.GetGitHash() == self.ReadLineAt(hash_file, 1)
+            index = subprocess.run(
+                ["git", "-C", str(self.source_dir), "ls-files", "--stage", "-z"],
+                capture_output=True, check=True
+            ).stdout
+            # Hard linking a file into the install folder changes its ctime, which
+            # would make git list it as modified. '--relative' prints paths the way
+            # 'ls-files' does when the source dir is a subfolder of the repository.
+            modified = subprocess.run(
+                [
+                    "git", "-C", str(self.source_dir), "-c", "core.trustctime=false",
+                    "diff-files", "--name-only", "--relative", "-z"
+                ],
+                capture_output=True, check=True
+            ).stdout
+        except (OSError, subprocess.CalledProcessError):
+            self.content_hash = self.GetGitHash()
+            return self.content_hash
+
+        modified_paths = set(modified.split(b"\0"))
+        content = hashlib.sha256()
+
+        # Each entry is '<mode> <object> <stage>\t<path>'
+        for entry in index.split(b"\0"):
+            if not entry:
+                continue
+
+            info, _, path = entry.partition(b"\t")
+            if path in modified_paths:
+                mode, blob, stage = info.split(b" ")
+                blob = self._HashWorkingFile(path, mode, len(blob) == 64)
+                info = b" ".join((mode, blob, stage))
+
+            content.update(info + b"\t" + path + b"\0")
+
+        self.content_hash = content.hexdigest()
+        return self.content_hash
+
+    # Computes the object name git would give to the working copy of `path`
+    def _HashWorkingFile(self, path: bytes, mode: bytes, sha256: bool) -> bytes:
+        full_path = self.source_dir / os.fsdecode(path)
+
+        # Submodule, its object is the checked out commit
+        if mode == b"160000":
+            commit = self._ReadGitHead(full_path)
+            if commit is None and (full_path / ".git").exists():
+                try:
+                    commit = subprocess.run(
+                        ["git", "-C", str(full_path), "rev-parse", "HEAD"],
+                        capture_output=True, text=True, check=True
+                    ).stdout.strip()
+                except (OSError, subprocess.CalledProcessError):
+                    pass
+            return commit.encode() if commit else b"modified"
+
+        try:
+            if mode == b"120000":
+                data = os.fsencode(os.readlink(full_path))
+            else:
+                data = full_path.read_bytes()
+        except OSError:
+            # Deleted file
+            return b"modified"
+
+        blob = hashlib.sha256() if sha256 else hashlib.sha1()
+        blob.update(b"blob %d\0" % len(data))
+        blob.update(data)
+        return blob.hexdigest().encode()
+
+    def CheckGitHash(self, hashes: dict[str, Any]) -> bool:
+        try:
+            return self.GetContentHash() == hashes.get("git")
         except subprocess.CalledProcessError as e:
             log(f"Failed to get git hash for {self.source_dir}!\nError: {e}", LogType.Error)
         return False
 
-    def IsHashRelevant(self, hash_file: Path) -> bool:
-        if hash_file.exists() and self.CheckGitHash(hash_file):
+    # Stats witness files, whose (mtime, size) is checked before hashing sources.
+    # Any commit, checkout or 'git add' touches the git ones, the branch ref file
+    # HEAD points to moves without touching HEAD, and '.' changes when top-level
+    # entries are added or removed. Git files are keyed as if '.git' was a folder.
+    # Returns None when the source dir isn't a git checkout, since then the
+    # witnesses can't notice a changed checkout. Taken once, before sources are
+    # hashed, so edits made during a build invalidate the stored witnesses.
+    def GetWitnesses(self) -> Optional[dict[str, Any]]:
+        if self.witnesses is not None:
+            return self.witnesses
+
+        git_dirs = self.GetGitDirs(self.source_dir)
+        if git_dirs is None:
+            return None
+        git_dir, common_dir = git_dirs
+
+        paths = {
+            ".git/HEAD": os.path.join(git_dir, "HEAD"),
+            ".git/index": os.path.join(git_dir, "index"),
+            ".git/packed-refs": os.path.join(common_dir, "packed-refs"),
+            "CMakeLists.txt": os.path.join(self.source_dir, "CMakeLists.txt"),
+            ".": str(self.source_dir),
+        }
+        try:
+            head = Path(paths[".git/HEAD"]).read_text(encoding="utf-8").strip()
+        except OSError:
+            return None
+        if head.startswith("ref: "):
+            ref = head[len("ref: "):]
+            paths[".git/" + ref] = os.path.join(common_dir, ref)
+
+        witnesses: dict[str, Any] = {}
+        for name, path in paths.items():
+            try:
+                st = os.stat(path)
+                witnesses[name] = [st.st_mtime_ns, st.st_size]
+            except OSError:
+                witnesses[name] = None # E.g. ref is packed
+
+        if witnesses[".git/index"] is None:
+            return None
+
+        self.witnesses = witnesses
+        return self.witnesses
+
+    def IsHashRelevant(self, hashes: dict[str, Any]) -> bool:
+        # Nothing was touched since the last check, skip hashing the sources
+        witnesses = self.GetWitnesses()
+        if witnesses is not None and witnesses == hashes.get("stat"):
             return True
-        return False
 
-    def WriteHash(self, hash_file) -> None:
-        self.WriteLineAt(hash_file, 1, self.GetGitHash())
+        return self.CheckGitHash(hashes)
+
+    def GetHashes(self) -> dict[str, Any]:
+        return {"git": self.GetContentHash(), "stat": self.GetWitnesses()}
+
+    def WriteHash(self, hash_file: Path) -> None:
+        self.StoreHashes(hash_file, self.GetHashes())
+
+        # Hash file used to be a plain text file. It can only be left
+        # if there was no JSON one yet.
+        if not self.previous_hashes:
+            hash_file.with_suffix(".txt").unlink(missing_ok=True)
+
+    def GetHashFile(self) -> Path:
+        if self.hash_file is None:
+            self.hash_file = (
+                CACHE_ROOT / self.install_dir_base if CACHE_ROOT else self.install_dir
+            ) / f"hash_{self.lib_name}.json"
+        return self.hash_file
 
     def InstallLibrary(self) -> None:
-        global SOURCES_ROOT, INSTALL_ROOT, CACHE_ROOT
+        hash_file = self.GetHashFile()
 
-        hash_file: Path = (
-            CACHE_ROOT / self.install_dir_base if CACHE_ROOT else self.install_dir
-        ) / f"hash_{self.lib_name}.txt"
+        hashes = self.LoadHashes(hash_file)
+        self.previous_hashes = hashes
+        if self.IsHashRelevant(hashes):
+            # Sources were touched but not changed, remember new witnesses
+            if hashes.get("stat") != self.GetWitnesses():
+                self.WriteHash(hash_file)
 
-        if self.IsHashRelevant(hash_file):
             log(f"[{self.lib_name}] is up to date.")
             return
 
-        if not self.install_dir.exists():
-            self.install_dir.mkdir(parents=True)
+        # Header-only libraries share one folder and may get here from several workers
+        self.install_dir.mkdir(parents=True, exist_ok=True)
 
         log(f"Installing [{self.lib_name}]...")
 
@@ -197,181 +662,671 @@ class CMakeLibrary(InstallingLibrary):
 
     def __init__(
         self,
-        source_dir_base: Path,
-        install_dir_base: Path,
-        build_dir: Path | None = None,
+        source_dir_base: str,
+        install_dir_base: str,
+        build_dir: str = "build",
         extra_args: list[str] | None = None,
         build_debug: bool = False
     ) -> None:
         super().__init__(source_dir_base, install_dir_base)
         self.extra_args = extra_args or []
-        self.build_dir = build_dir or Path("build")
+        self.build_dir = Path(build_dir)
         self.build_hash = None
         self.build_debug = build_debug
 
-    # For parallel work of this script we need to lock the build dir
     @staticmethod
-    def _AcquireLock(lock_file: Path):
-        lock_file.parent.mkdir(parents=True, exist_ok=True)
-        f = open(lock_file, "w")
-
+    def ReadCacheValue(build_dir: Path, name: str) -> Optional[str]:
         try:
-            if os.name == "nt":
-                import msvcrt
+            for line in (build_dir / "CMakeCache.txt").read_text(errors="replace").splitlines():
+                # NAME:TYPE=VALUE
+                key, sep, value = line.partition("=")
+                if sep and key.partition(":")[0] == name:
+                    return value
+        except OSError:
+            pass
+        return None
 
-                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    @staticmethod
+    def IsGeneratorMultiConfig(build_dir: Path) -> bool:
+        generator = CMakeLibrary.ReadCacheValue(build_dir, "CMAKE_GENERATOR") or ""
+
+        return (generator.startswith("Visual Studio") or
+            generator in ("Ninja Multi-Config", "FASTBuild", "Xcode")
+        )
+
+    # Guesses from arguments and environment whether the build uses MSVC, i.e. default
+    # compilers with a Visual Studio generator, or with Ninja inside a Visual Studio
+    # developer environment (otherwise Ninja may well use MinGW gcc) on Windows
+    @staticmethod
+    def _UsesMsvc(cmake_cmd: list[str]) -> bool:
+        if PLATFORM != "Windows" or "CC" in os.environ or "CXX" in os.environ:
+            return False
+
+        generator = os.environ.get("CMAKE_GENERATOR")
+        for i, arg in enumerate(cmake_cmd):
+            if arg.startswith(("-DCMAKE_C_COMPILER", "-DCMAKE_CXX_COMPILER", "-DCMAKE_TOOLCHAIN_FILE")):
+                return False
+            if arg == "-G" and i + 1 < len(cmake_cmd):
+                generator = cmake_cmd[i + 1]
+            elif arg.startswith("-G") and arg != "-G":
+                generator = arg[2:]
+
+        if generator is None or generator.startswith("Visual Studio"):
+            return True
+        return generator.startswith("Ninja") and has_msvc_environment()
+
+    # CMake options taking a value, which may be passed as a separate argument
+    VALUE_OPTIONS = ("-G", "-T", "-A", "-C", "-D", "-U", "-S", "-B")
+
+    # Order independent form of CMake arguments: definitions are sorted by name and
+    # only the last one of each name is kept, just like CMake does. Other arguments
+    # keep their order and go first. '-U' removes entries depending on order, so
+    # arguments with it are kept as is.
+    @staticmethod
+    def CanonicalizeArgs(args: list[str]) -> list[str]:
+        pairs: list[tuple[str, str]] = []
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg in CMakeLibrary.VALUE_OPTIONS and i + 1 < len(args):
+                pairs.append((arg, args[i + 1]))
+                i += 2
+            else:
+                pairs.append((arg[:2], arg[2:]) if arg.startswith(CMakeLibrary.VALUE_OPTIONS) else (arg, ""))
+                i += 1
+
+        if any(option == "-U" for option, _ in pairs):
+            return [ option + value for option, value in pairs ]
+
+        others = []
+        definitions: dict[str, str] = {}
+        for option, value in pairs:
+            if option == "-D":
+                name = re.split("[:=]", value, maxsplit=1)[0]
+                definitions.pop(name, None) # Keep only the last one
+                definitions[name] = value
             else:
-                import fcntl
+                others.append(option + value)
+        return others + [ "-D" + definitions[name] for name in sorted(definitions) ]
 
-                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
-            return f
-        except (OSError, BlockingIOError):
-            f.close()
+    # Global args are hashed too, changing them must rebuild every library.
+    # Each arg is terminated with '\0', so ['a b'] and ['a', 'b'] hash differently.
+    def GetBuildHash(self) -> str:
+        if self.build_hash is None:
+            args = self.extra_args + CMAKE_GLOBAL_ARGS
+            canonical = self.CanonicalizeArgs(args)
+            log(f"[{self.lib_name}] cmake args: {shlex.join(args)}\n"
+                f"[{self.lib_name}] hashed as: {shlex.join(canonical)}", log_level=LogLevel.V1
+            )
+
+            h = hashlib.blake2b(digest_size=16)
+            for arg in canonical:
+                h.update(arg.encode())
+                h.update(b"\0")
+            self.build_hash = h.hexdigest()
+        return self.build_hash
+
+    def CheckBuildHash(self, hashes: dict[str, Any]) -> bool:
+        return self.GetBuildHash() == hashes.get("build")
+
+    def IsHashRelevant(self, hashes: dict[str, Any]) -> bool:
+        return super().IsHashRelevant(hashes) and self.CheckBuildHash(hashes)
+
+    def GetHashes(self) -> dict[str, Any]:
+        return {**super().GetHashes(), "build": self.GetBuildHash()}
+
+    @staticmethod
+    def _ReadInstallManifest(build_dir: Path) -> Optional[set[str]]:
+        try:
+            lines = (build_dir / "install_manifest.txt").read_text(encoding="utf-8").splitlines()
+        except OSError:
             return None
+        return { os.path.normcase(os.path.abspath(line)) for line in lines if line.strip() }
+
+    # Merged install manifest of all configs, stored next to the hash file
+    def GetManifestFile(self) -> Path:
+        return self.GetHashFile().with_name(f"manifest_{self.lib_name}.txt")
+
+    # First line of the stored manifest. The cache dir may be shared by runs with
+    # different install dirs, so a manifest is used only by the one that wrote it.
+    def _ManifestHeader(self) -> str:
+        return f"# {os.path.normcase(os.path.abspath(self.install_dir))}"
+
+    def _ReadStoredManifest(self) -> Optional[set[str]]:
+        stored = self._ReadStoredManifestFile()
+        return stored[0] if stored is not None else None
+
+    # Returns installed files and the build state they were installed from, if known
+    def _ReadStoredManifestFile(self) -> Optional[tuple[set[str], Optional[str]]]:
+        try:
+            lines = self.GetManifestFile().read_text(encoding="utf-8").splitlines()
+        except OSError:
+            return None
+        if not lines or lines[0] != self._ManifestHeader():
+            return None
+
+        build_state = None
+        if len(lines) > 1 and lines[1].startswith(BUILD_STATE_PREFIX):
+            build_state = lines[1][len(BUILD_STATE_PREFIX):]
+            lines = lines[1:]
+        return { line for line in lines[1:] if line }, build_state
+
+    def _WriteStoredManifest(self, installed: Optional[set[str]], build_state: Optional[str] = None) -> None:
+        manifest_file = self.GetManifestFile()
+        if installed is None:
+            manifest_file.unlink(missing_ok=True)
+        else:
+            lines = [ self._ManifestHeader() ]
+            if build_state is not None:
+                lines.append(BUILD_STATE_PREFIX + build_state)
+            lines += sorted(installed)
+            write_atomic(manifest_file, "".join(f"{line}\n" for line in lines).encode("utf-8"))
+
+    # Copy of the install tree for current sources and arguments, so going back to
+    # an already built commit restores it instead of building it again. Installed
+    # files may embed the absolute install prefix (pkg-config files, CMake configs,
+    # RPATHs), so it's part of the key, as well as the set of built configs.
+    def GetInstallSnapshotDir(self) -> Optional[Path]:
+        if CACHE_ROOT is None:
+            return None
+        key_data = "\0".join((
+            self.GetContentHash(),
+            self.GetBuildHash(),
+            os.path.normcase(os.path.abspath(self.install_dir)),
+            "debug" if self.build_debug else "release",
+        ))
+        key = hashlib.sha256(key_data.encode()).hexdigest()[:16]
+        return CACHE_ROOT / "installs" / self.lib_name / key
 
     @staticmethod
-    def IsGeneratorMultiConfig(build_dir: Path) -> bool:
+    def _CopyInstalledFile(src: str, dst: str) -> None:
+        # Installed symlinks (e.g. libfoo.so -> libfoo.so.1) are kept as symlinks
+        if os.path.islink(src):
+            if os.path.lexists(dst):
+                os.unlink(dst)
+            os.symlink(os.readlink(src), dst)
+        else:
+            if os.path.islink(dst):
+                os.unlink(dst)
+            fast_copy(src, dst)
+
+    def _RestoreInstallSnapshot(self, snapshot_dir: Path) -> bool:
         try:
-            cache = build_dir / "CMakeCache.txt"
-            generator: str = ""
-
-            with cache.open() as f:
-                for line in f:
-                    if line.startswith("CMAKE_GENERATOR:"):
-                        generator = line.split("=")[1].strip()
-
-            if (generator.startswith("Visual Studio") or
-                generator in ("Ninja Multi-Config", "FASTBuild", "Xcode")
-            ):
-                return True
+            rel_paths = (snapshot_dir / "manifest.txt").read_text(encoding="utf-8").splitlines()
         except OSError:
-            pass
-        return False
+            return False
 
-    def GetBuildHash(self):
-        if self.build_hash is None:
-            import hashlib
+        if CLEAN_INSTALL and self.install_dir.exists():
+            shutil.rmtree(self.install_dir)
 
-            data_str = "|".join(self.extra_args)
-            self.build_hash = hashlib.md5(data_str.encode()).hexdigest()
-        return self.build_hash
+        install_dir = os.path.abspath(self.install_dir)
+        files_dir = os.path.join(snapshot_dir, "files")
+        restored: set[str] = set()
+        for rel in rel_paths:
+            if not rel:
+                continue
+            target = os.path.join(install_dir, rel)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            self._CopyInstalledFile(os.path.join(files_dir, rel), target)
+            restored.add(os.path.normcase(target))
+
+        if not CLEAN_INSTALL:
+            self._PruneInstallDir(restored)
+        self._WriteStoredManifest(restored)
+
+        os.utime(snapshot_dir) # Mark as recently used
+        return True
+
+    def _SaveInstallSnapshot(self, snapshot_dir: Path, installed: set[str]) -> None:
+        # Real file names are taken from the install folder, manifest entries are normcased
+        install_dir = os.path.abspath(self.install_dir)
+        rel_paths = []
+        for root, _, files in os.walk(install_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                if os.path.normcase(path) in installed:
+                    rel_paths.append(os.path.relpath(path, install_dir))
+        if len(rel_paths) != len(installed):
+            # Something was installed outside of the install folder
+            log(f"[{self.lib_name}] install tree can't be cached.", log_level=LogLevel.V1)
+            return
 
-    def CheckBuildHash(self, hash_file: Path):
+        tmp_dir = snapshot_dir.with_name(f"{snapshot_dir.name}.tmp{os.getpid()}-{threading.get_ident()}")
         try:
-            return self.GetBuildHash() == self.ReadLineAt(hash_file, 2)
-        except subprocess.CalledProcessError as e:
-            log(f"Failed to get git hash for {self.source_dir}!\nError: {e}", LogType.Error)
-        return False
+            for rel in rel_paths:
+                target = os.path.join(tmp_dir, "files", rel)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                self._CopyInstalledFile(os.path.join(install_dir, rel), target)
+            (tmp_dir / "manifest.txt").write_text("".join(f"{rel}\n" for rel in sorted(rel_paths)), encoding="utf-8")
+            os.replace(tmp_dir, snapshot_dir)
+        except OSError:
+            # E.g. another instance saved the same snapshot first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+
+        # Drop least recently used ones. Other instances may be removing them at the
+        # same time, a snapshot that is already gone counts as the oldest.
+        last_used: dict[Path, int] = {}
+        try:
+            for p in snapshot_dir.parent.iterdir():
+                if "." in p.name:
+                    continue
+                try:
+                    last_used[p] = p.stat().st_mtime_ns
+                except OSError:
+                    last_used[p] = -1
+        except OSError:
+            return
+        snapshots = sorted(last_used, key=last_used.__getitem__, reverse=True)
+        for old in snapshots[INSTALL_SNAPSHOTS_KEPT:]:
+            shutil.rmtree(old, ignore_errors=True)
+
+    # (mtime, size) of every build output. CMakeFiles only holds intermediate files
+    # and the files below are written by this script or 'cmake --install' itself.
+    @staticmethod
+    def _SnapshotBuildDir(build_dir: Path) -> dict[str, tuple[int, int]]:
+        ignored = { ".lock", ".configure_hash", "install_manifest.txt" }
+        snapshot: dict[str, tuple[int, int]] = {}
+        for root, dirs, files in os.walk(build_dir):
+            dirs[:] = [ d for d in dirs if d != "CMakeFiles" ]
+            for name in files:
+                if root == str(build_dir) and name in ignored:
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (st.st_mtime_ns, st.st_size)
+        return snapshot
 
-    def IsHashRelevant(self, hash_file) -> bool:
-        return super().IsHashRelevant(hash_file) and self.CheckBuildHash(hash_file)
+    # Identifies the build folder state installed files were taken from
+    @staticmethod
+    def _BuildStateFingerprint(configure_hash: str, snapshot: dict[str, tuple[int, int]]) -> str:
+        fingerprint = hashlib.blake2b(configure_hash.encode(), digest_size=16)
+        for path, (mtime, size) in sorted(snapshot.items()):
+            fingerprint.update(f"\0{path}\0{mtime}\0{size}".encode())
+        return fingerprint.hexdigest()
+
+    # Removes files left by a previous install that the current one didn't install.
+    # Only files of the previous manifest are checked, the install folder isn't walked.
+    def _PruneInstallDir(self, installed: set[str]) -> None:
+        previous = self._ReadStoredManifest()
+        if previous is None:
+            # Installed before manifests were stored, or by hand
+            self._PruneInstallDirByWalk(installed)
+            return
 
-    def WriteHash(self, hash_file) -> None:
-        super().WriteHash(hash_file)
-        self.WriteLineAt(hash_file, 2, self.GetBuildHash())
+        install_dir = os.path.normcase(os.path.abspath(self.install_dir))
+        for path in sorted(previous - installed):
+            # Files installed to absolute paths outside of the install dir are left alone
+            if not path.startswith(install_dir + os.sep):
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                continue
+            log(f"Removing stale file: {path}", log_level=LogLevel.V1)
+
+            # Remove folders left empty
+            parent = os.path.dirname(path)
+            while os.path.normcase(parent).startswith(install_dir + os.sep):
+                try:
+                    os.rmdir(parent)
+                except OSError:
+                    break
+                parent = os.path.dirname(parent)
+
+    def _PruneInstallDirByWalk(self, installed: set[str]) -> None:
+        hash_file = os.path.abspath(self.GetHashFile())
+        manifest_file = os.path.abspath(self.GetManifestFile())
+        keep = installed | { os.path.normcase(hash_file), os.path.normcase(manifest_file) }
+        # Temporary files of write_atomic
+        tmp_prefixes = (os.path.basename(hash_file) + ".", os.path.basename(manifest_file) + ".")
+
+        for root, dirs, files in os.walk(self.install_dir.absolute(), topdown=False):
+            for name in files:
+                path = os.path.join(root, name)
+                if os.path.normcase(path) not in keep and not (name.startswith(tmp_prefixes) and name.endswith(".tmp")):
+                    log(f"Removing stale file: {path}", log_level=LogLevel.V1)
+                    os.unlink(path)
+
+            for name in dirs:
+                try:
+                    os.rmdir(os.path.join(root, name)) # Only succeeds for empty dirs
+                except OSError:
+                    pass
 
     def BuildAndInstall(self) -> None:
+        snapshot_dir = self.GetInstallSnapshotDir()
+        if snapshot_dir is not None and not FORCE_CLEAN and self._RestoreInstallSnapshot(snapshot_dir):
+            log(f"[{self.lib_name}] restored from cache.")
+            return
+
         log(f"Compiling [{self.lib_name}]...")
 
         # Prepare build dir to allow multiple instance of this script at one time
         build_dir: Path = self.source_dir / self.build_dir
         n = 0
-        lock = None
+        lock: Optional[FileLock] = None
 
         stage = "acquire lock file"
         try:
             # Lock directory
             while True:
                 lock_file = build_dir / ".lock"
-                lock = CMakeLibrary._AcquireLock(lock_file)
-                if lock is not None:
-                    # Delete all files and folders except .lock file
-                    for item in build_dir.iterdir():
-                        if item.name == lock_file.name:
-                            continue
-                        if item.is_dir():
-                            shutil.rmtree(item)
-                        else:
-                            item.unlink()
+                lock = FileLock(lock_file)
+                if lock.Acquire():
                     break
                 else:
                     # Use build-{n} folder instead
                     n += 1
                     build_dir = self.source_dir / f"{self.build_dir}-{n}"
 
+            # Build folder is kept between runs, so CMake and the build tool
+            # only redo the work affected by changes
+            if FORCE_CLEAN:
+                stage = "clean build folder"
+                # Delete all files and folders except .lock file
+                for item in build_dir.iterdir():
+                    if item.name == lock_file.name:
+                        continue
+                    if item.is_dir():
+                        shutil.rmtree(item)
+                    else:
+                        item.unlink()
+
             # Configure
             stage = "configure"
             cmake_cmd = [
                 CMAKE,
                 "..",
-                f"-DCMAKE_INSTALL_PREFIX={self.install_dir}",
-                f"-DCMAKE_PREFIX_PATH={INSTALL_ROOT}",
+                f"-DCMAKE_INSTALL_PREFIX={self.install_dir.absolute()}",
+                f"-DCMAKE_PREFIX_PATH={INSTALL_ROOT.absolute()}",
             ] + self.extra_args + CMAKE_GLOBAL_ARGS
 
+            # Keep compiled objects between rebuilds, unless launcher was set explicitly
+            if COMPILER_CACHE and not any("_COMPILER_LAUNCHER" in arg for arg in cmake_cmd):
+                cmake_cmd += [
+                    f"-DCMAKE_C_COMPILER_LAUNCHER={COMPILER_CACHE}",
+                    f"-DCMAKE_CXX_COMPILER_LAUNCHER={COMPILER_CACHE}",
+                ]
+
+            # Ninja is used when no generator was chosen. The multi-config one
+            # builds both configs without reconfiguring in between.
+            if USE_NINJA and not any(arg.startswith("-G") for arg in cmake_cmd):
+                cmake_cmd += [ "-G", "Ninja Multi-Config" if self.build_debug else "Ninja" ]
+
+            if PRESEED and self._UsesMsvc(cmake_cmd) and MSVC_PRESEED_FILE.is_file():
+                cmake_cmd[2:2] = [ "-C", str(MSVC_PRESEED_FILE.absolute()) ]
+
             configs = ["Release"]
             if self.build_debug:
                 configs.append("Debug")
                 cmake_cmd.append("-DCMAKE_DEBUG_POSTFIX=d")
 
-            subprocess.run(cmake_cmd, cwd=build_dir, check=True)
+            # Configure only when arguments changed since the last configure of this folder.
+            # Otherwise 'cmake --build' reruns configure itself if any CMakeLists.txt changed.
+            configure_hash = hashlib.blake2b("\0".join(cmake_cmd).encode(), digest_size=16).hexdigest()
+            configure_hash_file = build_dir / ".configure_hash"
+            cache_file = build_dir / "CMakeCache.txt"
+
+            try:
+                configured = cache_file.exists() and configure_hash_file.read_text().strip() == configure_hash
+            except OSError:
+                configured = False
+
+            # Installing is skipped for configs whose build left the build folder exactly
+            # as it was when the last install finished, if sources are the same as at
+            # that install and it's still in place. The stored build state is dropped
+            # until this install succeeds, so a failed one can't be taken as current.
+            stored_manifest = self._ReadStoredManifestFile()
+            stored, installed_state = stored_manifest if stored_manifest is not None else (None, None)
+            can_skip_install = (
+                not CLEAN_INSTALL
+                and stored is not None
+                and installed_state is not None
+                and self.previous_hashes.get("git") == self.GetContentHash()
+                and all(os.path.isfile(path) for path in stored)
+            )
+            if installed_state is not None:
+                self._WriteStoredManifest(stored)
+
+            if not configured:
+                # Start with a fresh cache, so removed arguments don't stay in it.
+                # Compiled objects are kept.
+                cache_file.unlink(missing_ok=True)
+                configure_hash_file.unlink(missing_ok=True) # In case configure fails
+                run_command(cmake_cmd, build_dir, self.lib_name)
+                configure_hash_file.write_text(configure_hash)
 
             isMulti = self.IsGeneratorMultiConfig(build_dir)
             needToCleanupInstall = True
+            installed: Optional[set[str]] = set()
+
+            # Cores are split between libraries built at the same time.
+            # Without a number CMake uses CMAKE_BUILD_PARALLEL_LEVEL, if set.
+            parallel = [ "--parallel" ]
+            if "CMAKE_BUILD_PARALLEL_LEVEL" not in os.environ:
+                parallel.append(str(max(1, (os.cpu_count() or 1) // JOBS)))
 
             for config in configs:
                 if isMulti:
-                    build_cmd = [ CMAKE, "--build", ".", "--config", config, "--parallel" ] # todo: job count argument
+                    build_cmd = [ CMAKE, "--build", ".", "--config", config ] + parallel
                 else:
                     # Reconfigure
-                    cmake_cmd = [ CMAKE, f"-DCMAKE_BUILD_TYPE={config}", ".." ]
-                    stage = "reconfigure"
-                    subprocess.run(cmake_cmd, cwd=build_dir, check=True)
-                    build_cmd = [ CMAKE, "--build", ".", "--parallel" ] # todo: job count argument
+                    if self.ReadCacheValue(build_dir, "CMAKE_BUILD_TYPE") != config:
+                        cmake_cmd = [ CMAKE, f"-DCMAKE_BUILD_TYPE={config}", ".." ]
+                        stage = "reconfigure"
+                        run_command(cmake_cmd, build_dir, self.lib_name)
+                    build_cmd = [ CMAKE, "--build", "." ] + parallel
 
                 # Build
                 stage = "build"
-                subprocess.run(build_cmd, cwd=build_dir, check=True)
+                run_command(build_cmd, build_dir, self.lib_name)
 
                 log(f"[{self.lib_name}] successfully built" + (f" in {config} configuration." if len(configs) > 1 else "."),
                     LogType.Success
                 )
 
+                # Files of the previous install are kept, so 'cmake --install' only
+                # copies changed ones. Stale files are removed after install.
                 stage = "cleanup install folder"
                 if needToCleanupInstall:
-                    if self.install_dir.exists():
+                    if CLEAN_INSTALL and self.install_dir.exists():
                         shutil.rmtree(self.install_dir)
-                    self.install_dir.mkdir(parents=True)
+                    self.install_dir.mkdir(parents=True, exist_ok=True)
                     needToCleanupInstall = False
 
+                if can_skip_install:
+                    build_state = self._BuildStateFingerprint(configure_hash, self._SnapshotBuildDir(build_dir))
+                    if build_state == installed_state:
+                        log(f"[{self.lib_name}] nothing changed in build, skipping install.", log_level=LogLevel.V1)
+                        if installed is not None:
+                            installed |= stored
+                        continue
+
                 # Install
                 stage = "install"
                 if isMulti:
                     install_cmd = [ CMAKE, "--install", ".", "--config", config ]
-                    subprocess.run(install_cmd, cwd=build_dir, check=True)
+                    run_command(install_cmd, build_dir, self.lib_name)
                 else:
                     install_cmd = [ CMAKE, "--install", "." ]
-                    subprocess.run(install_cmd, cwd=build_dir, check=True)
+                    run_command(install_cmd, build_dir, self.lib_name)
+
+                # Each install overwrites the manifest, so collect all configs
+                manifest = self._ReadInstallManifest(build_dir)
+                if manifest is None or installed is None:
+                    installed = None
+                else:
+                    installed |= manifest
+
+            stage = "remove stale files"
+            if not CLEAN_INSTALL:
+                if installed is not None:
+                    self._PruneInstallDir(installed)
+                else:
+                    log(f"[{self.lib_name}] install manifest not found, stale files are kept.", LogType.Warning)
+            self._WriteStoredManifest(
+                installed,
+                self._BuildStateFingerprint(configure_hash, self._SnapshotBuildDir(build_dir)) if installed is not None else None
+            )
+
+            if snapshot_dir is not None and installed is not None:
+                stage = "cache install tree"
+                self._SaveInstallSnapshot(snapshot_dir, installed)
         except Exception:
             log(f"Failed to {stage}!", LogType.Error)
             raise
         finally:
             if lock is not None:
-                lock.close() # Unlock the build folder
-            shutil.rmtree(build_dir)
+                lock.Release() # Unlock the build folder
+
+
+# Lists a folder as (subfolders, files, symlinked subfolders). Sources don't change
+# while the script runs, so listings are cached and rules or libraries looking into
+# the same folders list them once.
+@functools.cache
+def list_dir(path: str) -> tuple[tuple[str, ...], tuple[str, ...], frozenset[str]]:
+    dirs: list[str] = []
+    files: list[str] = []
+    links: set[str] = set()
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    dirs.append(entry.name)
+                    if entry.is_symlink():
+                        links.add(entry.name)
+                else:
+                    files.append(entry.name)
+    except OSError:
+        pass
+    return tuple(dirs), tuple(files), frozenset(links)
+
+
+# Same as os.walk (top-down, symlinked folders aren't entered), but uses cached listings
+def walk_dir(top: str):
+    stack = [ top ]
+    while stack:
+        path = stack.pop()
+        dirs, files, links = list_dir(path)
+        dir_names = list(dirs)
+        yield path, dir_names, files
+        stack.extend(os.path.join(path, name) for name in reversed(dir_names) if name not in links)
+
+
+# Glob pattern compiled once, matched against paths split into parts.
+# Follows glob.glob(recursive=True) rules: '*' doesn't cross folders, '**' matches
+# any number of folders, and names starting with '.' are matched only by parts
+# that start with '.' too.
+class GlobPattern(object):
+    parts: list[Optional[re.Pattern]]
+    hidden: list[bool]
+    max_depth: Optional[int]
+
+    def __init__(self, pattern: str) -> None:
+        names = [ name for name in pattern.replace("\\", "/").split("/") if name ]
+
+        # None stands for '**'
+        self.parts = [ None if name == "**" else GlobPattern._CompilePart(name) for name in names ]
+        self.hidden = [ name.startswith(".") for name in names ]
+        self.max_depth = None if "**" in names else len(names)
+
+    # Same parts (e.g. '*.dll', 'include') repeat across rules and libraries
+    @staticmethod
+    @functools.cache
+    def _CompilePart(name: str) -> re.Pattern:
+        return re.compile(fnmatch.translate(name), re.IGNORECASE if os.name == "nt" else 0)
+
+    # Patterns are never changed after creation, so libraries with the same
+    # patterns (e.g. header libraries) share compiled ones
+    @staticmethod
+    @functools.cache
+    def Get(pattern: str) -> "GlobPattern":
+        return GlobPattern(pattern)
+
+    @staticmethod
+    def ExpandBraces(pattern: str) -> list[str]:
+        """
+        Expands the first `{a,b}` group of a pattern, recursively.
+
+        Example:
+        `"**/{libsteam_api.so,libtier0_s.a}"` ->
+        `["**/libsteam_api.so", "**/libtier0_s.a"]`
+        """
+        start = pattern.find("{")
+        end = pattern.find("}", start)
+        if start == -1 or end == -1:
+            return [pattern]
+
+        head, tail = pattern[:start], pattern[end + 1:]
+        return [
+            expanded
+            for option in pattern[start + 1:end].split(",")
+            for expanded in GlobPattern.ExpandBraces(head + option + tail)
+        ]
+
+    # Whether entries inside folder `name` at `depth` (1 for the root's children) can match
+    def CanDescend(self, name: str, depth: int) -> bool:
+        if self.max_depth is not None and depth >= self.max_depth:
+            return False
+        return not name.startswith(".") or any(self.hidden)
+
+    def Match(self, parts: list[str], i: int = 0, j: int = 0) -> bool:
+        while j < len(self.parts):
+            part = self.parts[j]
+
+            if part is None:
+                # '**' consumes any number of not hidden folders
+                for k in range(i, len(parts) + 1):
+                    if self.Match(parts, k, j + 1):
+                        return True
+                    if k < len(parts) and parts[k].startswith("."):
+                        break
+                return False
+
+            if i >= len(parts):
+                return False
+            if parts[i].startswith(".") and not self.hidden[j]:
+                return False
+            if not part.match(parts[i]):
+                return False
+            i += 1
+            j += 1
+
+        return i == len(parts)
 
 
 class ManualLibrary(InstallingLibrary):
     rules: list[tuple[str, str, str]]
+    compiled_rules: list[tuple[str, list[GlobPattern], str, list[GlobPattern]]]
 
-    def __init__(self, source_dir_base: Path, install_dir_base: Path, rules: list[tuple[str, str, str]] | None = None) -> None:
+    def __init__(self, source_dir_base: str, install_dir_base: str, rules: list[tuple[str, str, str]] | None = None) -> None:
         super().__init__(source_dir_base, install_dir_base)
         self.rules = rules or []
 
+        # Patterns are compiled once here instead of on every directory entry
+        self.compiled_rules = []
+        for pattern, dst_subdir, exclude_pattern in self.rules:
+            fixed_prefix, sub_pattern = ManualLibrary._SplitPattern(pattern)
+            self.compiled_rules.append((
+                str(fixed_prefix),
+                [ GlobPattern.Get(p) for p in GlobPattern.ExpandBraces(sub_pattern) ] if sub_pattern else [],
+                dst_subdir,
+                [ GlobPattern.Get(p) for p in GlobPattern.ExpandBraces(exclude_pattern) ] if exclude_pattern else [],
+            ))
+
     @staticmethod
     def _SplitPattern(pattern: str) -> tuple[Path, str]:
         """
         Splits a path pattern into a fixed prefix and a wildcard sub-pattern.
-        `fixed_prefix` is the path up to (but not including) the first part containing a wildcard (*, ?, [).
+        `fixed_prefix` is the path up to (but not including) the first part containing a wildcard (*, ?, [, {).
         `sub_pattern` is the remaining part of the path starting from the first wildcard.
 
         Example:
@@ -381,65 +1336,129 @@ class ManualLibrary(InstallingLibrary):
         parts = Path(pattern).parts
 
         for i, part in enumerate(parts):
-            if any(ch in part for ch in "*?["):
+            if any(ch in part for ch in "*?[{"):
                 fixed = Path(*parts[:i])
                 sub = "/".join(parts[i:])
                 return fixed, sub
         return Path(*parts), ""
 
     def BuildAndInstall(self) -> None:
-        for pattern, dst_subdir, exclude_pattern in self.rules:
-            fixed_prefix, sub_pattern = ManualLibrary._SplitPattern(pattern)
-            glob_root = self.source_dir / fixed_prefix
+        # Plain strings are used instead of Path here, every match would otherwise
+        # be wrapped into several temporary Path objects
+        source_dir = str(self.source_dir)
+        install_dir = str(self.install_dir)
+
+        # Several rules usually copy into the same folders (e.g. 'bin'),
+        # so remember ones that already exist
+        created_dirs: set[str] = set()
+
+        def make_dirs(path: str) -> None:
+            if path in created_dirs:
+                return
+            if os.path.dirname(path) in created_dirs:
+                # Parent exists, so no need to check the whole chain
+                try:
+                    os.mkdir(path)
+                except FileExistsError:
+                    pass
+            else:
+                os.makedirs(path, exist_ok=True)
+            created_dirs.add(path)
+
+        # Rules with wildcards, grouped by the folder they start at
+        groups: dict[str, list[tuple[list[GlobPattern], str, list[GlobPattern]]]] = {}
 
-            if not glob_root.exists():
+        for (fixed_prefix, patterns, dst_subdir, excludes), (_, _, exclude_pattern) in zip(self.compiled_rules, self.rules):
+            glob_root = os.path.join(source_dir, fixed_prefix)
+            dst_root = os.path.join(install_dir, dst_subdir)
+
+            if not os.path.exists(glob_root):
                 log(f"Pattern base path not found: {glob_root}", LogType.Warning)
                 continue
 
-            if glob_root.is_file():
+            # No wildcards, so the path is already known and no globbing is needed
+            if not patterns:
                 if exclude_pattern != "":
                     log(f"There is no need in exclude glob '{exclude_pattern}' if you copy path.\n"
                         "Exclude glob excludes files only from glob.", LogType.Warning
                     )
-                target = self.install_dir / dst_subdir / glob_root.name
-                target.parent.mkdir(parents=True, exist_ok=True)
-                shutil.copy2(glob_root, target)
+                if os.path.isdir(glob_root):
+                    shutil.copytree(glob_root, dst_root, copy_function=link_or_copy, dirs_exist_ok=True)
+                else:
+                    make_dirs(dst_root)
+                    link_or_copy(glob_root, os.path.join(dst_root, os.path.basename(glob_root)))
                 continue
 
-            matches = set(Path(p) for p in glob(str(glob_root / sub_pattern), recursive=True))
+            # Pattern like '**' matches the root itself
+            if any(pattern.Match([]) for pattern in patterns):
+                shutil.copytree(glob_root, dst_root, copy_function=link_or_copy, dirs_exist_ok=True)
+                continue
 
-            exclude_matches = set()
-            if exclude_pattern:
-                ex_root = self.source_dir / fixed_prefix / exclude_pattern
+            groups.setdefault(glob_root, []).append((patterns, dst_root, excludes))
+
+        # Files are grouped by target folder, so each folder is created once
+        files_by_dir: dict[str, list[tuple[str, str]]] = {}
+
+        # Tree is walked once per starting folder and every entry is matched with
+        # compiled patterns of all rules of the group. Listings reuse file types
+        # returned by os.scandir, so no extra stat is needed.
+        for glob_root, group in groups.items():
+            # Indices of rules still looking into each folder, a folder is entered
+            # only while at least one rule needs it
+            active: dict[str, list[int]] = { glob_root: list(range(len(group))) }
+
+            for dir_path, dir_names, file_names in walk_dir(glob_root):
+                rules = active.pop(dir_path)
+                rel_dir = os.path.relpath(dir_path, glob_root)
+                rel_parts = [] if rel_dir == "." else rel_dir.split(os.sep)
+                depth = len(rel_parts) + 1
+
+                descend = []
+                for name in dir_names:
+                    parts = rel_parts + [name]
+                    child_rules = []
+                    for i in rules:
+                        patterns, dst_root, excludes = group[i]
+                        if any(ex.Match(parts) for ex in excludes):
+                            continue
 
-                if ex_root.exists():
-                    exclude_matches = set(Path(p) for p in glob(str(ex_root), recursive=True))
+                        if any(pattern.Match(parts) for pattern in patterns):
+                            # Copied with everything inside, this rule doesn't need to look into it
+                            target = os.path.join(dst_root, *parts)
+                            shutil.copytree(os.path.join(dir_path, name), target, copy_function=link_or_copy, dirs_exist_ok=True)
+                        elif any(pattern.CanDescend(name, depth) for pattern in patterns):
+                            child_rules.append(i)
 
-            to_copy = matches - exclude_matches
+                    if child_rules:
+                        descend.append(name)
+                        active[os.path.join(dir_path, name)] = child_rules
+                dir_names[:] = descend
 
-            for full_path in to_copy:
-                try:
-                    rel_path = full_path.relative_to(glob_root)
-                except ValueError:
-                    log(f"Failed to compute relative path for {full_path}", LogType.Warning)
-                    continue
+                for name in file_names:
+                    parts = rel_parts + [name]
+                    for i in rules:
+                        patterns, dst_root, excludes = group[i]
+                        if any(pattern.Match(parts) for pattern in patterns) and not any(ex.Match(parts) for ex in excludes):
+                            target_dir = os.path.join(dst_root, *rel_parts)
+                            files_by_dir.setdefault(target_dir, []).append((os.path.join(dir_path, name), os.path.join(target_dir, name)))
 
-                target = self.install_dir / dst_subdir / rel_path
+        # All target folders are known before copying. They are created parents
+        # first, so nested ones take a single mkdir.
+        for target_dir in sorted(files_by_dir, key=lambda path: path.count(os.sep)):
+            make_dirs(target_dir)
 
-                if full_path.is_dir():
-                    shutil.copytree(full_path, target, dirs_exist_ok=True)
-                else:
-                    target.parent.mkdir(parents=True, exist_ok=True)
-                    shutil.copy2(full_path, target)
+        for target_dir, files in files_by_dir.items():
+            for full_path, target in files:
+                link_or_copy(full_path, target)
 
 
 class HeaderLibrary(ManualLibrary):
-    def __init__(self, source_dir_base: Path, install_dir_base: Path | None = None, paths: list[str] | None = None) -> None:
+    def __init__(self, source_dir_base: str, install_dir_base: str = "", paths: list[str] | None = None) -> None:
         global HEADER_SUBDIR
         super().__init__(
             source_dir_base,
-            HEADER_SUBDIR,
-            [(p, str(install_dir_base), "") for p in (paths or [])]
+            str(HEADER_SUBDIR),
+            [(p, install_dir_base or ".", "") for p in (paths or [])]
         )
 
 
@@ -520,9 +1539,9 @@ class CMakeCommand(LibraryCommand[CMakeLibrary]):
             raise ValueError(f"Failed to parse cmake args for {namespace.src}!\nError: {e}")
 
         return CMakeLibrary(
-            source_dir_base=Path(namespace.src),
-            install_dir_base=Path(namespace.install),
-            build_dir=Path(namespace.build_dir),
+            source_dir_base=namespace.src,
+            install_dir_base=namespace.install,
+            build_dir=namespace.build_dir,
             extra_args=extra_cmake_args,
             build_debug=namespace.build_debug
         )
@@ -566,8 +1585,8 @@ class HeaderCommand(LibraryCommand[HeaderLibrary]):
 
     def _CreateLibrary(self, namespace: argparse.Namespace) -> HeaderLibrary:
         return HeaderLibrary(
-            source_dir_base=Path(namespace.src),
-            install_dir_base=Path(namespace.install_subdir),
+            source_dir_base=namespace.src,
+            install_dir_base=namespace.install_subdir,
             paths=namespace.glob
         )
 
@@ -656,8 +1675,8 @@ class ManualCommand(LibraryCommand[ManualLibrary]):
                 raise ValueError(f"Failed to parse 'rule' args: {rule_args}. Error: {e}")
 
         return ManualLibrary(
-            source_dir_base=Path(namespace.src),
-            install_dir_base=Path(namespace.install),
+            source_dir_base=namespace.src,
+            install_dir_base=namespace.install,
             rules=rules
         )
 
@@ -683,12 +1702,15 @@ def create_main_parser():
         help="Root directory containing library source code. (Default: 'src')"
     )
     main_parser.add_argument(
-        "--install-dir", type=Path, default=Path("bin") / platform.system(),
+        "--install-dir", type=Path, default=Path("bin") / PLATFORM,
         help="Root directory for built library installations. (Default: 'bin/<platform>')"
     )
     main_parser.add_argument(
         "--cache-dir", type=str, default=None,
-        help="Directory for hash files. (Default: '<INSTALL_DIR>/<library_installation_folder>')"
+        help=(
+            "Directory for hash files and cached install trees of CMake libraries.\n"
+            "(Default: '<INSTALL_DIR>/<library_installation_folder>', install trees aren't cached)"
+        )
     )
     main_parser.add_argument(
         "--cmake", type=str, default="cmake",
@@ -702,31 +1724,124 @@ def create_main_parser():
         "--header-subdir", type=Path, default=Path("header-only"),
         help="Subdirectory under <INSTALL_DIR> for header-only libraries. (Default: 'header-only')"
     )
+    main_parser.add_argument(
+        "--compiler-cache", choices=["auto", "off", "ccache", "sccache"], default="auto",
+        help=(
+            "Compiler cache used as compiler launcher for CMake libraries.\n"
+            "'auto' uses ccache or sccache if one is found in PATH. (Default: 'auto')"
+        )
+    )
+    main_parser.add_argument(
+        "--no-compiler-cache", dest="compiler_cache", action="store_const", const="off",
+        help="Same as '--compiler-cache=off'."
+    )
+    main_parser.add_argument(
+        "--clean-install", action="store_true",
+        help="Delete install folder of CMake libraries before installing instead of removing only stale files."
+    )
+    main_parser.add_argument(
+        "--force-clean", action="store_true",
+        help="Delete build folders of CMake libraries before building instead of building incrementally."
+    )
+    main_parser.add_argument(
+        "-j", "--jobs", "--parallel", type=int, default=1,
+        help=(
+            "Number of libraries installed at the same time. (Default: 1)\n"
+            "Libraries are installed concurrently, so use it only when they don't depend on each other.\n"
+            "CPU cores are split between them for building."
+        )
+    )
+    main_parser.add_argument(
+        "--hardlink", action=argparse.BooleanOptionalAction, default=os.name != "nt",
+        help=(
+            "Install files of manual and header-only libraries as hard links to sources when possible.\n"
+            "(Default: on, except on Windows)"
+        )
+    )
+    main_parser.add_argument(
+        "--no-preseed", action="store_true",
+        help="Don't pass the initial cache with known results of configure checks to CMake on MSVC builds."
+    )
+    main_parser.add_argument(
+        "-v", "--verbose", action="count", default=0,
+        help="Print more details, repeat for even more (e.g. -vv)."
+    )
 
     return main_parser
 
 
-# For every argument from sys.argv, this function returns a grouping key (count, cmd).
-# The key stays the same for all consecutive arguments belonging to the same command.
-# When a new command token is encountered, 'count' is incremented (indicating that
-# this is other group) and 'cmd' changes. itertools.groupby() will then group
-# arguments until the key changes, effectively collecting each command with its
-# parameters into a separate list.
-#
-# inspired by https://stackoverflow.com/a/10449310/16793487
-def groupargs(arg, state={'cmd': None, 'count': 0}, known_commands: list[str] | None = None):
-    if arg in known_commands:
-        state['cmd'] = arg
-        state['count'] += 1
-    elif state['cmd'] is None:
-        state['cmd'] = 'global'
-        state['count'] = 0
+# Splits command line into groups, each starting with a command token:
+# [("global", [...]), ("add-cmake-lib", ["add-cmake-lib", ...]), ...]
+# Arguments before the first command belong to the "global" group.
+def group_args(args: list[str], command_names: list[str]) -> list[tuple[str, list[str]]]:
+    groups: list[tuple[str, list[str]]] = []
+
+    for arg in args:
+        if arg in command_names:
+            groups.append((arg, [arg]))
+        elif not groups:
+            groups.append(("global", [arg]))
+        else:
+            groups[-1][1].append(arg)
+
+    return groups
+
+
+# Returns path to the compiler cache executable or None if it shouldn't be used
+def find_compiler_cache(choice: str) -> Optional[str]:
+    if choice == "off":
+        return None
+
+    for tool in (("ccache", "sccache") if choice == "auto" else (choice,)):
+        path = shutil.which(tool)
+        if path:
+            return path
+
+    if choice != "auto":
+        log(f"Compiler cache '{choice}' not found, building without it.", LogType.Warning)
+    return None
 
-    # (0, 'global'), (1, 'add-cmake-lib'), (2, 'add-cmake-lib'), ...
-    return (state['count'], state['cmd'])
+
+# Whether the script runs in a Visual Studio developer prompt, where cl can be found
+def has_msvc_environment() -> bool:
+    return "VCINSTALLDIR" in os.environ or shutil.which("cl") is not None
+
+
+# Ninja configures and builds faster than CMake's default generators. It's used only if
+# generator isn't set by CMAKE_GENERATOR. On Windows it also needs the environment of
+# a Visual Studio developer prompt to find the compiler.
+def should_use_ninja() -> bool:
+    if "CMAKE_GENERATOR" in os.environ or shutil.which("ninja") is None:
+        return False
+    if os.name == "nt":
+        return has_msvc_environment()
+    return True
+
+
+# Installs libraries using up to `jobs` worker threads. Workers spend almost all
+# of their time waiting for CMake, so threads are enough here. Concurrent builds
+# of the same source tree are handled by the build dir lock in CMakeLibrary.
+def install_libraries(libraries: list[InstallingLibrary], jobs: int) -> None:
+    pending: list[InstallingLibrary] = []
+    for library in libraries:
+        if not library.source_dir.exists():
+            log(f"Source folder not found: {library.source_dir}", LogType.Warning)
+            continue
+        pending.append(library)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = { executor.submit(library.InstallLibrary): library for library in pending }
+
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                log(f"Failed to process {futures[future].lib_name}!\nError: {e}", LogType.Error)
+                # Let already running builds finish, but don't start new ones
+                executor.shutdown(wait=True, cancel_futures=True)
+                sys.exit(1)
 
 
-# todo: add --parallel argument for parallel build
 def main():
     global \
         SOURCES_ROOT, \
@@ -734,7 +1849,15 @@ def main():
         CACHE_ROOT, \
         HEADER_SUBDIR, \
         CMAKE, \
-        CMAKE_GLOBAL_ARGS
+        CMAKE_GLOBAL_ARGS, \
+        CLEAN_INSTALL, \
+        COMPILER_CACHE, \
+        FORCE_CLEAN, \
+        JOBS, \
+        USE_NINJA, \
+        HARDLINK, \
+        PRESEED, \
+        CURRENT_LOG_LEVEL
 
     main_parser = create_main_parser()
     main_namespace = argparse.Namespace()
@@ -743,25 +1866,37 @@ def main():
     COMMANDS = register_commands()
     COMMAND_NAMES = [ command.GetName() for command in COMMANDS ]
     COMMAND_MAP = { command.GetName(): command for command in COMMANDS }
+    handlers: dict[str, LibraryCommand] = {}
 
     # Group commands
-    command_groups = [ (key, list(args))
-                       for key, args in itertools.groupby(sys.argv[1:], lambda arg: groupargs(arg, known_commands=COMMAND_NAMES)) ]
+    command_groups = group_args(sys.argv[1:], COMMAND_NAMES)
 
     # Acquire global args
     global_group_args = []
-    if command_groups and command_groups[0][0][1] == 'global':
+    if command_groups and command_groups[0][0] == 'global':
         _, args_list = command_groups.pop(0)
         global_group_args = args_list
 
     # Global variables initialization
     main_parser.parse_args(global_group_args or [], namespace=main_namespace)
 
+    CURRENT_LOG_LEVEL = LogLevel(min(main_namespace.verbose, LogLevel.V3))
     SOURCES_ROOT = main_namespace.sources_dir
     INSTALL_ROOT = main_namespace.install_dir
     CACHE_ROOT = Path(main_namespace.cache_dir) if main_namespace.cache_dir else None
     HEADER_SUBDIR = main_namespace.header_subdir
-    CMAKE = main_namespace.cmake
+    # Absolute path, so subprocesses don't search PATH on every call
+    CMAKE = shutil.which(main_namespace.cmake) or main_namespace.cmake
+    CLEAN_INSTALL = main_namespace.clean_install
+    FORCE_CLEAN = main_namespace.force_clean
+    COMPILER_CACHE = find_compiler_cache(main_namespace.compiler_cache)
+    USE_NINJA = should_use_ninja()
+    PRESEED = not main_namespace.no_preseed
+    HARDLINK = main_namespace.hardlink
+
+    # Make ccache hashes independent of where sources are checked out
+    if COMPILER_CACHE:
+        os.environ.setdefault("CCACHE_BASEDIR", str(SOURCES_ROOT.absolute()))
 
     try:
         CMAKE_GLOBAL_ARGS = shlex.split(main_namespace.cmake_args)
@@ -769,30 +1904,27 @@ def main():
         log(f"Failed to parse global --cmake-args!\nError: {e}", LogType.Error)
         sys.exit(1)
 
-    for key, cmdline in command_groups:
-        cmd_name = key[1]
+    if main_namespace.jobs < 1:
+        log(f"--jobs must be at least 1, got {main_namespace.jobs}!", LogType.Error)
+        sys.exit(1)
 
+    for cmd_name, cmdline in command_groups:
         if not cmdline:
             log(f"No arguments passed to {cmd_name}", LogType.Warning)
             continue
 
         try:
-            command_handler = COMMAND_MAP[cmd_name]()
+            # Parsers are created once per command type and only for used commands
+            command_handler = handlers.get(cmd_name)
+            if command_handler is None:
+                command_handler = handlers[cmd_name] = COMMAND_MAP[cmd_name]()
             libraries.append(command_handler.CreateLibrary(cmdline[1:]))
         except Exception as e:
             log(f"Failed to process command: {' '.join(cmdline)}!\nError: {e}", LogType.Error)
             sys.exit(1)
 
-    for library in libraries:
-        if not library.source_dir.exists():
-            log(f"Source folder not found: {library.source_dir}", LogType.Warning)
-            continue
-
-        try:
-            library.InstallLibrary()
-        except Exception as e:
-            log(f"Failed to process {library.lib_name}!\nError: {e}", LogType.Error)
-            sys.exit(1)
+    JOBS = main_namespace.jobs
+    install_libraries(libraries, JOBS)
 
     if not(libraries):
         log("Nothing to do.")
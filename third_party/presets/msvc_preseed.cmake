@@ -0,0 +1,25 @@
+# Initial cache for MSVC builds, passed by deps.py with '-C'.
+#
+# Results of header checks (check_include_file and friends) that are the same
+# for every MSVC toolchain with the Universal CRT (Visual Studio 2015+).
+# Preseeded results let CMake skip compiling a test program for each of them.
+# Only headers that always exist or never exist there are listed.
+
+# Present
+foreach(_deps_header
+    ASSERT CTYPE ERRNO FCNTL FLOAT INTTYPES IO LIMITS LOCALE MALLOC MATH MEMORY
+    SIGNAL STDARG STDBOOL STDDEF STDINT STDIO STDLIB STRING SYS_STAT SYS_TYPES
+    TIME WCHAR WINDOWS
+)
+    set(HAVE_${_deps_header}_H 1 CACHE INTERNAL "Have include ${_deps_header}")
+endforeach()
+
+# Absent
+foreach(_deps_header
+    ALLOCA DIRENT DLFCN LIBGEN POLL PTHREAD STRINGS SYS_IOCTL SYS_MMAN SYS_PARAM
+    SYS_SOCKET SYS_TIME TERMIOS UNISTD
+)
+    set(HAVE_${_deps_header}_H "" CACHE INTERNAL "Have include ${_deps_header}")
+endforeach()
+
+unset(_deps_header)